@@ -17,22 +17,52 @@
 # You should have received a copy of the GNU General Public License along with
 # Chinese Support Redux.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
+from functools import lru_cache
+from json import dumps
+from weakref import WeakKeyDictionary, WeakSet
+
 from anki.hooks import addHook
 from aqt import mw
 
 from .behavior import update_fields
 from .main import config
 
+TONE_CSS_RULE = re.compile(
+    r'^\.tone\d[^\S\n]*\{[^}\n]*\}(?=[^\S\n]*$)', re.MULTILINE
+)
+
+BUTTON_STATE_JS = (
+    'var button = document.getElementById("chineseSupport");'
+    'if (button) button.classList.toggle("highlighted", %s);'
+)
+
+TONE_STYLE_JS = (
+    'var style = document.getElementById("chineseSupportTones");'
+    'if (!style) {'
+    'style = document.createElement("style");'
+    'style.id = "chineseSupportTones";'
+    'document.head.appendChild(style);'
+    '}'
+    'style.textContent = %s;'
+)
+
 
 class EditManager:
     def __init__(self):
         addHook('setupEditorButtons', self.setupButton)
         addHook('loadNote', self.updateButton)
         addHook('editFocusLost', self.onFocusLost)
+        self.enabledModels = set(config['enabledModels'])
+        self.editors = WeakSet()
+        self.buttonStates = WeakKeyDictionary()
+        self.pendingRefreshes = {}
+        self.refreshScheduled = False
 
     def setupButton(self, buttons, editor):
-        self.editor = editor
-        self.buttonOn = False
+        self.editors.add(editor)
+        enabled = editor.note is not None and self.isEnabled(editor.note)
+        self.buttonStates[editor] = enabled
         editor._links['chineseSupport'] = self.onToggle
 
         button = editor._addButton(
@@ -43,49 +73,85 @@ class EditManager:
             id='chineseSupport',
             toggleable=True)
 
+        if enabled:
+            button = button.replace('class="', 'class="highlighted ', 1)
+
         return buttons + [button]
 
-    def onToggle(self, editor):
-        self.buttonOn = not self.buttonOn
+    def isEnabled(self, note):
+        return str(note.model()['id']) in self.enabledModels
 
+    def onToggle(self, editor):
+        # the button's onclick has already flipped its own highlight
         mid = str(editor.note.model()['id'])
+        enabled = not self.buttonStates.get(editor, False)
 
-        if self.buttonOn and mid not in config['enabledModels']:
-            config['enabledModels'].append(mid)
-        elif not self.buttonOn and mid in config['enabledModels']:
-            config['enabledModels'].remove(mid)
+        if enabled:
+            self.enabledModels.add(mid)
+        else:
+            self.enabledModels.discard(mid)
 
+        self.buttonStates[editor] = enabled
+
+        config['enabledModels'] = sorted(self.enabledModels)
         config.save()
 
     def updateButton(self, editor):
-        enabled = str(editor.note.model()['id']) in config['enabledModels']
+        enabled = self.isEnabled(editor.note)
 
-        if (enabled and not self.buttonOn) or (not enabled and self.buttonOn):
-            editor.web.eval('toggleEditorButton(chineseSupport);')
-            self.buttonOn = not self.buttonOn
+        if enabled != self.buttonStates.get(editor, False):
+            editor.web.eval(BUTTON_STATE_JS % dumps(enabled))
+            self.buttonStates[editor] = enabled
 
     def onFocusLost(self, _, note, index):
-        if not self.buttonOn:
+        model = note.model()
+
+        if str(model['id']) not in self.enabledModels:
             return False
 
-        allFields = mw.col.models.fieldNames(note.model())
+        allFields = mw.col.models.fieldNames(model)
         field = allFields[index]
 
         if update_fields(note, field, allFields):
+            # coalesced per note: only the latest focus target is kept
             if index == len(allFields) - 1:
-                self.editor.loadNote(focusTo=index)
+                self.pendingRefreshes[id(note)] = (note, index)
             else:
-                self.editor.loadNote(focusTo=index+1)
+                self.pendingRefreshes[id(note)] = (note, index + 1)
+
+            if not self.refreshScheduled:
+                self.refreshScheduled = True
+                mw.progress.timer(0, self.refreshEditor, False)
 
         return False
 
+    def refreshEditor(self):
+        pending = self.pendingRefreshes
+        self.pendingRefreshes = {}
+        self.refreshScheduled = False
+
+        for note, focusTo in pending.values():
+            for editor in list(self.editors):
+                if editor.note is not note:
+                    continue
+                try:
+                    editor.loadNote(focusTo=focusTo)
+                except RuntimeError:
+                    # the editor's web view has already been deleted by Qt
+                    self.editors.discard(editor)
+
+
+@lru_cache(maxsize=128)
+def _extract_tone_rules(css):
+    if '.tone' not in css:
+        return ()
+    return tuple(TONE_CSS_RULE.findall(css))
+
 
 def append_tone_styling(editor):
-    js = 'var css = document.styleSheets[0];'
+    rules = _extract_tone_rules(editor.note.model()['css'])
 
-    for line in editor.note.model()['css'].split('\n'):
-        if line.startswith('.tone'):
-            js += 'css.insertRule("{}", css.cssRules.length);'.format(
-                line.rstrip())
+    if not rules:
+        return
 
-    editor.web.eval(js)
+    editor.web.eval(TONE_STYLE_JS % dumps('\n'.join(rules)))
@@ -0,0 +1,262 @@
+# Copyright © 2018-2019 Joseph Lorimer <joseph@lorimer.me>
+#
+# This file is part of Chinese Support Redux.
+#
+# Chinese Support Redux is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Chinese Support Redux is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Chinese Support Redux.  If not, see <https://www.gnu.org/licenses/>.
+
+from json import dumps
+from unittest.mock import MagicMock, patch
+
+from chinese.edit import (
+    EditManager,
+    _extract_tone_rules,
+    append_tone_styling,
+)
+from chinese.main import config
+from tests import Base
+
+
+def make_editor(css, mid=1):
+    editor = MagicMock()
+    editor.note.model.return_value = {'id': mid, 'css': css}
+    return editor
+
+
+class AppendToneStyling(Base):
+    css = (
+        '.card {font-size: 20px;}\n'
+        '.tone1 {color: red;}\n'
+        '.tone2 {color: orange;}  \n'
+        '.tones {color: black;}\n'
+        '.tone3 {color: green;\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        _extract_tone_rules.cache_clear()
+
+    def test_tone_rules(self):
+        editor = make_editor(self.css)
+        append_tone_styling(editor)
+        js = editor.web.eval.call_args[0][0]
+        expected = dumps('.tone1 {color: red;}\n.tone2 {color: orange;}')
+        self.assertIn('style.textContent = %s;' % expected, js)
+        self.assertNotIn('.card', js)
+        self.assertNotIn('insertRule', js)
+
+    def test_malformed_rules_skipped(self):
+        editor = make_editor(self.css)
+        append_tone_styling(editor)
+        js = editor.web.eval.call_args[0][0]
+        self.assertNotIn('.tones', js)
+        self.assertNotIn('.tone3', js)
+
+    def test_crlf_line_endings(self):
+        editor = make_editor(
+            '.tone1 {color: red;}\r\n'
+            '.tone2 {color: blue;}\r\n'
+        )
+        append_tone_styling(editor)
+        js = editor.web.eval.call_args[0][0]
+        expected = dumps('.tone1 {color: red;}\n.tone2 {color: blue;}')
+        self.assertIn(expected, js)
+
+    def test_extract_tone_rules(self):
+        self.assertEqual(
+            _extract_tone_rules(self.css),
+            ('.tone1 {color: red;}', '.tone2 {color: orange;}'),
+        )
+        self.assertEqual(_extract_tone_rules('.card {color: red;}'), ())
+
+    def test_cached_per_note_type(self):
+        append_tone_styling(make_editor(self.css))
+        editor = make_editor(self.css)
+        with patch('chinese.edit.TONE_CSS_RULE') as rule:
+            append_tone_styling(editor)
+        rule.findall.assert_not_called()
+        self.assertIn('.tone1 {color: red;}', editor.web.eval.call_args[0][0])
+
+    def test_no_tone_rules_skips_regex(self):
+        editor = make_editor('.card {font-size: 20px;}')
+        with patch('chinese.edit.TONE_CSS_RULE') as rule:
+            append_tone_styling(editor)
+        rule.findall.assert_not_called()
+        editor.web.eval.assert_not_called()
+
+    def test_malformed_only_skips_eval(self):
+        editor = make_editor('.tone1 {color: red;\n')
+        append_tone_styling(editor)
+        append_tone_styling(editor)
+        editor.web.eval.assert_not_called()
+
+    def test_css_change_invalidates_cache(self):
+        append_tone_styling(make_editor(self.css))
+        editor = make_editor('.tone1 {color: purple;}')
+        append_tone_styling(editor)
+        js = editor.web.eval.call_args[0][0]
+        self.assertIn('.tone1 {color: purple;}', js)
+        self.assertNotIn('.tone2', js)
+
+
+class ToggleButton(Base):
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            patch.object(config, 'save'),
+            patch.dict(config.config, {'enabledModels': []}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = EditManager()
+
+    def test_toggle_enables_model(self):
+        self.manager.onToggle(make_editor('', mid=42))
+        self.assertEqual(config['enabledModels'], ['42'])
+        self.assertIn('42', self.manager.enabledModels)
+
+    def test_toggle_saves_sorted(self):
+        self.manager.onToggle(make_editor('', mid=7))
+        self.manager.onToggle(make_editor('', mid=42))
+        self.assertEqual(config['enabledModels'], ['42', '7'])
+        config.save.assert_called()
+
+    def test_toggle_twice_disables_model(self):
+        editor = make_editor('', mid=42)
+        self.manager.onToggle(editor)
+        self.manager.onToggle(editor)
+        self.assertEqual(config['enabledModels'], [])
+        self.assertNotIn('42', self.manager.enabledModels)
+
+    def test_update_button(self):
+        self.manager.onToggle(make_editor('', mid=42))
+        editor = make_editor('', mid=42)
+        self.manager.updateButton(editor)
+        self.assertTrue(self.manager.buttonStates[editor])
+        editor.web.eval.assert_called_once()
+        js = editor.web.eval.call_args[0][0]
+        self.assertIn('classList.toggle("highlighted", true)', js)
+
+    def test_update_button_unchanged(self):
+        editor = make_editor('', mid=42)
+        self.manager.updateButton(editor)
+        editor.web.eval.assert_not_called()
+
+    def test_setup_button_enabled(self):
+        self.manager.enabledModels.add('42')
+        editor = make_editor('', mid=42)
+        editor._addButton.return_value = '<button class="linkb">'
+        buttons = self.manager.setupButton([], editor)
+        self.assertEqual(buttons, ['<button class="highlighted linkb">'])
+        self.manager.updateButton(editor)
+        editor.web.eval.assert_not_called()
+
+    def test_setup_button_without_note(self):
+        editor = make_editor('')
+        editor.note = None
+        editor._addButton.return_value = '<button class="linkb">'
+        buttons = self.manager.setupButton([], editor)
+        self.assertEqual(buttons, ['<button class="linkb">'])
+        self.assertFalse(self.manager.buttonStates[editor])
+
+    def test_toggle_per_editor(self):
+        editor = make_editor('', mid=42)
+        other = make_editor('', mid=7)
+        self.manager.onToggle(editor)
+        self.assertTrue(self.manager.buttonStates[editor])
+        self.assertNotIn(other, self.manager.buttonStates)
+
+    def test_toggle_two_editors(self):
+        editor = make_editor('', mid=42)
+        other = make_editor('', mid=42)
+        self.manager.onToggle(editor)
+        self.manager.onToggle(other)
+        self.assertTrue(self.manager.buttonStates[other])
+        self.assertIn('42', self.manager.enabledModels)
+        self.manager.updateButton(other)
+        other.web.eval.assert_not_called()
+
+        self.manager.onToggle(other)
+        self.assertNotIn('42', self.manager.enabledModels)
+        self.manager.updateButton(editor)
+        js = editor.web.eval.call_args[0][0]
+        self.assertIn('classList.toggle("highlighted", false)', js)
+        self.assertFalse(self.manager.buttonStates[editor])
+
+
+class FocusLost(Base):
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            patch('chinese.edit.update_fields', return_value=True),
+            patch(
+                'chinese.edit.mw.col.models.fieldNames',
+                return_value=['Hanzi', 'Pinyin', 'English'],
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = EditManager()
+        self.manager.enabledModels = {'1'}
+        self.editor = make_editor('')
+        self.other = make_editor('')
+        self.manager.editors.update([self.editor, self.other])
+
+    def test_refresh_coalesced(self):
+        with patch('chinese.edit.mw.progress.timer') as timer:
+            self.manager.onFocusLost(False, self.editor.note, 0)
+            self.manager.onFocusLost(False, self.editor.note, 1)
+        timer.assert_called_once_with(0, self.manager.refreshEditor, False)
+        self.editor.loadNote.assert_not_called()
+        self.manager.refreshEditor()
+        self.editor.loadNote.assert_called_once_with(focusTo=2)
+        self.assertFalse(self.manager.refreshScheduled)
+        self.assertEqual(self.manager.pendingRefreshes, {})
+
+    def test_refresh_coalesced_per_note(self):
+        with patch('chinese.edit.mw.progress.timer') as timer:
+            self.manager.onFocusLost(False, self.editor.note, 0)
+            self.manager.onFocusLost(False, self.other.note, 1)
+        timer.assert_called_once()
+        self.manager.refreshEditor()
+        self.editor.loadNote.assert_called_once_with(focusTo=1)
+        self.other.loadNote.assert_called_once_with(focusTo=2)
+
+    def test_last_field_keeps_focus(self):
+        with patch('chinese.edit.mw.progress.timer'):
+            self.manager.onFocusLost(False, self.editor.note, 2)
+        self.manager.refreshEditor()
+        self.editor.loadNote.assert_called_once_with(focusTo=2)
+
+    def test_only_editor_with_note_refreshed(self):
+        with patch('chinese.edit.mw.progress.timer'):
+            self.manager.onFocusLost(False, self.other.note, 0)
+        self.manager.refreshEditor()
+        self.other.loadNote.assert_called_once_with(focusTo=1)
+        self.editor.loadNote.assert_not_called()
+
+    def test_deleted_editor_discarded(self):
+        self.editor.loadNote.side_effect = RuntimeError
+        with patch('chinese.edit.mw.progress.timer'):
+            self.manager.onFocusLost(False, self.editor.note, 0)
+        self.manager.refreshEditor()
+        self.assertNotIn(self.editor, self.manager.editors)
+
+    def test_disabled_model_ignored(self):
+        self.manager.enabledModels = set()
+        with patch('chinese.edit.mw.progress.timer') as timer:
+            self.assertFalse(
+                self.manager.onFocusLost(False, self.editor.note, 0)
+            )
+        timer.assert_not_called()
+        self.editor.note.model.assert_called_once()